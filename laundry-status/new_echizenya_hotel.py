@@ -7,25 +7,79 @@ Web 画面で「使用中 / 使用可」を表示するサンプル。
 - Ambient の値が THRESHOLD 以上の「間」ずっと『使用中』
 - THRESHOLD を下回ったら『使用可』
 - 以前あった 1分タイマー（ロック/クールダウン）機能は無し
-- Web 画面は Ambient の更新頻度（30秒）に合わせて 30秒おきに再取得
+- サーバ側が Ambient の更新頻度（30秒）に合わせて定期取得し、
+  Web 画面へは SSE（Server-Sent Events）でプッシュ配信する
 
 起動:
-  python env-test22_no_timer_30s_commented.py
-  → http://localhost:5000 をブラウザで開く
+  本番（推奨）: gunicorn のスレッドワーカーで起動する。
+    gunicorn -k gthread -w 2 --threads 16 -b 0.0.0.0:8080 new_echizenya_hotel:app
+    ※I/O 待ち（Ambient への問い合わせ・SSE の接続維持）が中心なので、
+      スレッドを多めにして同時接続をさばく。
+
+  開発（お試し）: python new_echizenya_hotel.py
+  → http://localhost:8080 をブラウザで開く
 """
 
 # Flask: Python だけで簡単に Web サーバ + API を作るためのフレームワーク
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, Response, render_template_string, request
 import os
+
+# gzip: 事前レンダリングした HTML を圧縮済みでも持っておくために使用
+import gzip
+
+# hashlib: /api/data の ETag（内容が変わったかの指紋）計算に使用
+import hashlib
+
+# threading/time: 取得結果の短時間キャッシュ（TTL キャッシュ）と
+# バックグラウンドの定期取得スレッドに使用
+import threading
+import time
+
+# socket/urlsplit: Ambient ホストの DNS 解決結果のキャッシュに使用
+import socket
+from urllib.parse import urlsplit
+
+# orjson: 標準の json より高速な JSON シリアライザ（datetime も直接扱える）
+import orjson
+
+# MappingProxyType: 書き換え不可の dict（定数テーブル用）
+from types import MappingProxyType
+
+# Flask-Compress: レスポンスを gzip 圧縮して転送量を減らす拡張
+from flask_compress import Compress
+
+# redis: 複数ワーカー間でのキャッシュ共有に使用（任意。未インストールでも動く）
+try:
+    import redis
+except ImportError:
+    redis = None
 # requests: HTTP 通信（Ambient API にアクセスする）
 import requests
 
+# HTTPAdapter/Retry: コネクションプーリングと自動リトライの設定に使用
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 # datetime/timezone: 取得時刻（サーバの現在時刻）や ISO8601 パースに使用
 from datetime import datetime, timezone
 
+# timezone.utc は毎回属性参照すると微妙に遅いので、定数として持っておく
+_UTC = timezone.utc
+
 # Flask アプリ本体を作成（この app にルーティングや設定を紐づける）
 app = Flask(__name__)
 
+# ===== レスポンスの gzip 圧縮 =====
+
+# HTML と JSON を gzip で圧縮して返す（モバイル回線での転送量が数分の一になる）。
+# ・text/event-stream（SSE）は対象外：圧縮バッファリングで
+#   「1件ずつ即送る」というSSE の性質が壊れる恐れがあるため
+# ・トップページは事前圧縮済み（Content-Encoding 設定済み）なので素通しされる
+app.config["COMPRESS_MIMETYPES"] = ["text/html", "application/json"]
+app.config["COMPRESS_MIN_SIZE"] = 200  # これより小さい本文は圧縮しない（逆効果）
+app.config["COMPRESS_LEVEL"] = 6       # 圧縮率と CPU 負荷のバランス
+Compress(app)
+
 # ===== Ambient 設定 =====
 
 DEFAULT_CHANNEL_ID = 95641
@@ -48,6 +102,174 @@ AMBIENT_URL = f"http://ambidata.io/api/v2/channels/{CHANNEL_ID}/data"
 # ※このしきい値は機器・センサによって調整してください
 THRESHOLD = 0.05
 
+# Ambient のデータ項目名（d1〜d4）。リクエストのたびにリストを
+# 作り直さないよう、タプルの定数にしておく
+_KEYS = ("d1", "d2", "d3", "d4")
+
+# 「全部値なし」の values（Ambient にデータがまだ無いときに使う）。
+# MappingProxyType は読み取り専用の dict。使うときは dict(...) でコピーする
+_EMPTY_VALUES = MappingProxyType({k: None for k in _KEYS})
+
+# ===== HTTP セッション（接続の使い回し） =====
+
+# 毎回 requests.get() すると、リクエストのたびに DNS 解決 + TCP 接続を
+# やり直してしまう。Session を1つ作って使い回すと、Keep-Alive で
+# 同じ接続を再利用できるので、Ambient への問い合わせが速く・軽くなる。
+SESSION = requests.Session()
+
+# 一時的なエラーは少し待って自動リトライする設定
+# connect=2: 接続（TCP ハンドシェイク）の失敗は2回までやり直す
+#            → SYN が詰まったとき、同じソケットで待ち続けず張り直す
+# read=1:    読み取り中の失敗は1回だけやり直す
+# status_forcelist: 502/503/504 が返ってきたときもリトライ対象にする
+_RETRY = Retry(
+    total=3,
+    connect=2,
+    read=1,
+    backoff_factor=0.2,
+    status_forcelist=(502, 503, 504),
+)
+
+# 接続プール付きのアダプタを http/https 両方に取り付ける
+# pool_connections: 接続先ホストごとのプール数 / pool_maxsize: プール内の最大接続数
+_ADAPTER = HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=_RETRY)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
+
+# Keep-Alive を明示して、プールした接続を使い回してもらう
+SESSION.headers["Connection"] = "keep-alive"
+SESSION.headers["Accept"] = "application/json"
+
+# ===== DNS キャッシュ（Ambient ホスト限定） =====
+
+# Keep-Alive が切れて接続を張り直すとき、毎回 DNS へ問い合わせると
+# 20〜50ms ほど余計にかかる。Ambient のホストに限って解決結果を
+# 5分間キャッシュし、張り直し時の DNS 往復を省く。
+_AMBIENT_HOST = urlsplit(AMBIENT_URL).hostname
+_DNS_TTL = 300  # 解決結果を使い回す期間（秒）
+_DNS_CACHE = {}  # getaddrinfo の全引数 -> (失効時刻, getaddrinfo の結果)
+
+# 元の getaddrinfo を残しておき、Ambient 以外のホストはそのまま通す
+_real_getaddrinfo = socket.getaddrinfo
+
+
+def _cached_getaddrinfo(host, port, *args, **kwargs):
+    """Ambient のホストに限って DNS 解決結果を使い回す getaddrinfo。"""
+    if host != _AMBIENT_HOST:
+        return _real_getaddrinfo(host, port, *args, **kwargs)
+
+    # キーには family / type / proto / flags まで全部含める。
+    # (host, port) だけをキーにすると、無条件の検索結果（TCP/UDP/RAW 混在）を
+    # urllib3 の「SOCK_STREAM 限定」の検索に返してしまい、接続失敗時に
+    # UDP ソケットへフォールバックして読み取りタイムアウトまで黙り込む
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    entry = _DNS_CACHE.get(key)
+    now = time.monotonic()
+
+    # キャッシュがあって期限内ならそれを返す（DNS へは行かない）
+    if entry is not None and now < entry[0]:
+        return entry[1]
+
+    result = _real_getaddrinfo(host, port, *args, **kwargs)
+    _DNS_CACHE[key] = (now + _DNS_TTL, result)
+    return result
+
+
+# requests（内部の urllib3）は接続時に socket.getaddrinfo を呼ぶので、
+# ここで差し替えるとプールの張り直し時にキャッシュが効く
+socket.getaddrinfo = _cached_getaddrinfo
+
+# 起動時に一度引いてキャッシュを温めておく。名前解決できない環境
+# （DNS 設定ミス等）は、最初のリクエストで気づくのではなく起動時に分かる。
+# 実際の接続と同じく TCP（SOCK_STREAM）に限定して引く
+try:
+    _cached_getaddrinfo(
+        _AMBIENT_HOST, urlsplit(AMBIENT_URL).port or 80, type=socket.SOCK_STREAM
+    )
+except OSError as e:
+    app.logger.warning("DNS warm-up for %s failed: %s", _AMBIENT_HOST, e)
+
+# ===== TTL キャッシュ（取得結果の短時間キャッシュ） =====
+
+# Ambient 自体が 30 秒に1回しか更新されないのに、閲覧者（タブ）ごとに
+# 毎回 Ambient へ問い合わせるのは無駄。直近の取得結果を 25 秒だけ
+# プロセス内に覚えておき、その間のリクエストにはキャッシュを返す。
+# これで閲覧者が何人いても Ambient へのアクセスは 25〜30 秒に1回になる。
+CACHE_TTL = 25  # キャッシュの有効期間（秒）。Ambient の更新間隔より少し短く
+
+# Ambient が一時的に落ちているとき、古いキャッシュで代用してよい上限（秒）。
+# これを超えて取得できない場合は素直にエラーを返す（古すぎる表示を防ぐ）。
+STALE_MAX = 300
+
+# ===== Redis による共有キャッシュ（複数ワーカー向け・任意） =====
+
+# gunicorn のワーカー（プロセス）を増やすと、プロセス内キャッシュは
+# ワーカーごとに独立し、Ambient への定期取得もワーカー数ぶん走ってしまう。
+# REDIS_URL（例: redis://localhost:6379/0）を設定すると取得結果を Redis で
+# 共有し、全ワーカー合わせて 25 秒に1回の取得に抑えられる。
+# 未設定（既定）なら、これまで通りプロセス内キャッシュだけで動く。
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+_REDIS = None
+if REDIS_URL and redis is not None:
+    # タイムアウトは短めにして、Redis が落ちていても画面表示を止めない
+    _REDIS = redis.Redis.from_url(REDIS_URL, socket_timeout=0.2)
+
+# Redis 上のキー。payload 本体と「取得役」を決めるロックの2つ
+_REDIS_KEY = f"ambient:{CHANNEL_ID}"
+_REDIS_LOCK_KEY = f"ambient:{CHANNEL_ID}:lock"
+
+_CACHE = {
+    "payload": None,  # 最後にブラウザへ返した JSON（dict）
+    "seq": 0,         # 更新のたびに1増える通し番号（SSE の取りこぼし防止用）
+    "etag": None,     # payload の ETag（created 時刻から計算した指紋）
+    "stale_since": None,  # 取得に失敗し続けている場合、最初に失敗した時刻
+    "lock": threading.Lock(),  # 同時に複数スレッドが取得しに行かないための鍵
+}
+
+# ===== SSE（Server-Sent Events）によるプッシュ配信 =====
+
+# 定期取得の間隔（秒）。Ambient の更新頻度（30秒）に合わせる
+POLL_INTERVAL = 30
+
+# SSE の接続維持（heartbeat）間隔（秒）。無通信が続くと中継の
+# プロキシ等に接続を切られることがあるので、これより短い間隔で
+# 中身のないコメント行を流して「生きている」ことを伝える
+HEARTBEAT_SEC = 25
+
+# SSE のメッセージの枠組み（"data: <JSON>\n\n"）。毎回文字列を組み立てて
+# encode し直さないよう、固定部分は bytes の定数にしておく。
+# Flask のストリーミングレスポンスは bytes をそのまま書き出してくれる
+_FRAME_PREFIX = b"data: "
+_FRAME_SUFFIX = b"\n\n"
+
+# ':' で始まる行は SSE のコメント（ブラウザは無視する）。接続維持用
+_HEARTBEAT_FRAME = b": keep-alive\n\n"
+
+# /api/data に付ける Cache-Control。
+# ・public, max-age: 手前の nginx や CDN がレスポンスを共有キャッシュしてよい
+#   → プロキシを立てれば、閲覧者が何人いても Flask へは 25 秒に1回しか来ない
+# ・stale-while-revalidate: 期限切れ直後は古いものを返しつつ裏で再取得してよい
+# ・stale-if-error: こちらがエラーの間は古いものを返し続けてよい（上限 STALE_MAX）
+#
+# nginx でキャッシュする場合の設定例:
+#   proxy_cache_path /var/cache/nginx keys_zone=amb:1m;
+#   location /api/data {
+#       proxy_pass http://127.0.0.1:8080;
+#       proxy_cache amb;
+#       proxy_cache_valid 200 25s;
+#       proxy_cache_use_stale error timeout updating;
+#   }
+_CACHE_CONTROL = (
+    f"public, max-age={CACHE_TTL}, "
+    f"stale-while-revalidate={POLL_INTERVAL}, stale-if-error={STALE_MAX}"
+)
+
+# キャッシュが更新されたことを SSE の各接続へ知らせるための Condition。
+# バックグラウンドの取得スレッドが notify_all() し、
+# ブラウザごとの SSE ジェネレータが wait() で待つ。
+_UPDATED = threading.Condition()
+
 
 # ===== 表示する HTML（1枚のページとして埋め込み） =====
 # render_template_string() に渡して、Python 変数（channel_id, threshold）を差し込んで表示します。
@@ -167,9 +389,13 @@ HTML = r"""<!doctype html>
   // Flask 側から差し込まれる（Python の THRESHOLD をそのまま渡す）
   const THRESHOLD = {{ threshold|safe }};
 
-  // 30秒ごとにサーバ（/api/data）へ取りに行く（Ambient の更新頻度に合わせる）
-  // ※数値はミリ秒。30秒 = 30 * 1000 = 30,000ms
-  const POLL_MS   = 30_000;
+  // 以前は 30 秒ごとのポーリング（setInterval + fetch）だったが、
+  // いまはサーバからの SSE プッシュ（/api/stream）で更新を受け取る。
+
+  // 各カードに最後に表示した値。同じ値なら DOM を触らずに済ませるための記録。
+  // 初期値の NaN は「NaN === 何とも一致しない」性質を利用していて、
+  // 最初の描画（null 含む）が必ず実行されるようにしている
+  const lastState = {d1: NaN, d2: NaN, d3: NaN, d4: NaN};
 
   // CSS 変数（--ok など）を JavaScript から参照したいときのヘルパ
   function getVar(name){
@@ -201,6 +427,12 @@ HTML = r"""<!doctype html>
   // d1〜d4 それぞれについて、数値 num をもとに「使用可/使用中/—」を表示する
   // num が null のときは「値が取れない」扱い
   function setAvailableView(key, num){
+    // 前回表示した値と同じなら何もしない。
+    // textContent / style の書き換えはスタイル再計算（レイアウト）を
+    // 引き起こすので、変化が無いときは丸ごとスキップする
+    if (lastState[key] === num) return;
+    lastState[key] = num;
+
     const el = document.getElementById(key);
 
     if(num === null){
@@ -263,31 +495,99 @@ HTML = r"""<!doctype html>
     }
   }
 
-  // ページ表示直後に1回取得
+  // ページ表示直後に1回取得（SSE の接続が確立する前でもすぐ描画される）
   load();
 
-  // 以降、POLL_MS（30秒）ごとに繰り返し取得
-  setInterval(load, POLL_MS);
+  // 以降はサーバからのプッシュ（SSE）で更新を受け取る。
+  // EventSource は切断されてもブラウザが自動で再接続してくれる。
+  const es = new EventSource('/api/stream');
+  es.onmessage = (e) => apply(JSON.parse(e.data));
 </script>
 </body>
 </html>"""
 
 
+# ===== トップページの事前レンダリング =====
+
+# channel_id / threshold は起動後に変わらない定数なので、アクセスのたびに
+# Jinja テンプレートをレンダリングするのは無駄。起動時に1回だけ
+# レンダリングして、その結果（文字列）を使い回す。
+with app.app_context():
+    _INDEX_HTML = render_template_string(HTML, channel_id=CHANNEL_ID, threshold=THRESHOLD)
+
+# gzip 圧縮済みのバイト列も先に作っておく（対応ブラウザにはこちらを返す）
+_INDEX_GZ = gzip.compress(_INDEX_HTML.encode("utf-8"))
+
+
 # ===== Flask ルーティング（URL と関数を紐づける） =====
 
 @app.route("/")
 def index():
-    """トップページ（HTML を返す）"""
-    # HTML テンプレートに channel_id と threshold を埋め込んで返す
-    return render_template_string(HTML, channel_id=CHANNEL_ID, threshold=THRESHOLD)
+    """トップページ（起動時にレンダリング済みの HTML を返す）"""
+
+    # ブラウザが gzip を受け取れるなら、圧縮済みバイト列をそのまま返す
+    # （転送量が数分の一になる。Vary はキャッシュの取り違え防止）
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        resp = Response(_INDEX_GZ, mimetype="text/html")
+        resp.headers["Content-Encoding"] = "gzip"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    return Response(_INDEX_HTML, mimetype="text/html")
 
 
 @app.route("/api/data")
 def api_data():
-    """ブラウザが定期取得する API。
+    """最新状態を1回だけ取得する API（初回表示とフォールバック用）。
+
+    Ambient への問い合わせはバックグラウンドの取得スレッドだけが行う
+    （シングルフライト）。この API はキャッシュを返すだけなので、
+    閲覧者が何人同時に来ても Ambient へのアクセス経路は常に1本で、
+    リクエスト処理中にネットワーク待ちでスレッドを塞ぐこともない。
+    """
 
-    Ambient API から最新1件を取り、
-    created（時刻）と d1〜d4 の値を JSON で返す。
+    # 取得スレッドが失敗し続けている → 古いキャッシュ or 502
+    if _CACHE["stale_since"] is not None:
+        return _stale_or_error("Ambient is unreachable")
+
+    # 通常ルート：取得スレッドが保っているキャッシュをそのまま返す
+    if _CACHE["payload"] is not None:
+        return _cached_response()
+
+    # 起動直後だけキャッシュが空なので、最初の取得が終わるのを少しだけ待つ
+    with _UPDATED:
+        _UPDATED.wait(timeout=5)
+
+    if _CACHE["payload"] is not None:
+        return _cached_response()
+
+    return _stale_or_error("Ambient data is not available yet")
+
+
+@app.route("/api/stream")
+def api_stream():
+    """SSE（Server-Sent Events）でブラウザへプッシュ配信する API。
+
+    ブラウザごとに接続を1本張りっぱなしにして、バックグラウンドの
+    取得スレッドがキャッシュを更新するたびに全接続へ送る。
+    30秒ごとの再取得（ポーリング）と違い、リクエストの往復が不要になる。
+    """
+    gen = _sse_stream()
+    resp = Response(gen, mimetype="text/event-stream")
+
+    # 切断時（タブを閉じた等）にジェネレータを確実に閉じて、
+    # 接続ごとに持っている状態（差分計算用の dict など）をすぐ解放する
+    resp.call_on_close(gen.close)
+    return resp
+
+
+# ===== ヘルパ関数 =====
+
+def _fetch_payload():
+    """Ambient API から最新1件を取得して、ブラウザへ返す payload を組み立てる。
+
+    失敗した場合は requests.RequestException / ValueError が上がる
+    （呼び出し側で except して _stale_or_error 等につなぐ）。
     """
 
     # Ambient の API に渡すクエリパラメータ
@@ -295,53 +595,281 @@ def api_data():
     # n: 何件取得するか（ここでは最新 1 件）
     params = {"readKey": READ_KEY, "n": 1}
 
+    # Ambient API へ GET（接続3秒 / 読み取り8秒 でタイムアウト）
+    # 合計しても次の取得周期（30秒）に収まるよう短めにして、
+    # 上流が詰まったときに取得スレッドが周期を丸ごと落とさないようにする
+    # ※requests.get ではなく SESSION.get を使うことで接続を使い回す
+    r = SESSION.get(AMBIENT_URL, params=params, timeout=(3, 8))
+
+    # HTTP ステータスが 4xx/5xx の場合は例外にする
+    r.raise_for_status()
+
+    # JSON を Python の list/dict に変換。
+    # r.json() は文字コード判定を挟んで bytes→str→json と経由するが、
+    # Ambient は UTF-8 固定なので、バイト列を直接 orjson に渡すほうが速い
     try:
-        # Ambient API へ GET（timeout=10 秒でタイムアウト）
-        r = requests.get(AMBIENT_URL, params=params, timeout=10)
+        data = orjson.loads(r.content)
+    except orjson.JSONDecodeError as e:
+        # 壊れた JSON は従来どおり ValueError のエラー経路に乗せる
+        raise ValueError(f"Malformed JSON from Ambient: {e}")
+
+    # Ambient 側にデータがまだ無い（空配列）ケース
+    # ※datetime は orjson がそのまま ISO8601 にしてくれるので isoformat() 不要
+    if not data:
+        return {
+            "created": None,
+            "server_now": datetime.now(_UTC),
+            "values": dict(_EMPTY_VALUES),
+        }
+
+    # 最新 1 件（n=1 なので data[0] が最新）
+    row = data[0]
+
+    # created フィールドを ISO8601 としてパース（UTC に揃える）
+    created_dt = _parse_iso8601(row.get("created"))
+    if created_dt is None:
+        # created が壊れている等のときは ValueError として呼び出し側へ
+        raise ValueError("Invalid created timestamp")
+
+    # d1〜d4 を float に変換（失敗したら None）。
+    # 毎回通る行なので内包表記をやめて展開し、row.get も
+    # ローカル変数に取ってメソッド参照のコストを1回にする
+    g = row.get
+    vals = {
+        "d1": _to_num(g("d1")),
+        "d2": _to_num(g("d2")),
+        "d3": _to_num(g("d3")),
+        "d4": _to_num(g("d4")),
+    }
 
-        # HTTP ステータスが 4xx/5xx の場合は例外にする
-        r.raise_for_status()
+    return {
+        "created": created_dt,
+        "server_now": datetime.now(_UTC),
+        "values": vals,
+    }
 
-        # JSON を Python の list/dict に変換
-        data = r.json()
 
-        # Ambient 側にデータがまだ無い（空配列）ケース
-        if not data:
-            return jsonify({
-                "created": None,
-                "server_now": datetime.now(timezone.utc).isoformat(),
-                "values": {"d1": None, "d2": None, "d3": None, "d4": None},
-            })
+def _fetch_shared():
+    """ワーカー間のキャッシュ共有を考慮して、最新の payload を手に入れる。
 
-        # 最新 1 件（n=1 なので data[0] が最新）
-        row = data[0]
+    Redis が設定されていればまず Redis を見る（他のワーカーが取得済みなら
+    それをそのまま使う）。無ければ NX ロックを取れた1ワーカーだけが
+    Ambient へ行き、結果を TTL 付きで Redis に置く。ロックを取れなかった
+    ワーカーは少しだけ待って Redis を読み直す。
+    Redis 未設定／障害時は、従来どおり直接 Ambient から取得する。
+    """
+    if _REDIS is None:
+        return _fetch_payload()
 
-        # created フィールドを ISO8601 としてパース（UTC に揃える）
-        created_dt = _parse_iso8601(row.get("created"))
-        if created_dt is None:
-            # created が壊れている等のときは ValueError を投げて下の except へ
-            raise ValueError("Invalid created timestamp")
+    try:
+        # 他のワーカーが置いてくれた結果があればそれで済ませる
+        cached = _REDIS.get(_REDIS_KEY)
+        if cached is not None:
+            return orjson.loads(cached)
+
+        # 取得役を1ワーカーに絞る（nx=True: キーを置けたワーカーが取得役）
+        if _REDIS.set(_REDIS_LOCK_KEY, "1", nx=True, ex=5):
+            payload = _fetch_payload()
+            body = orjson.dumps(payload, option=orjson.OPT_UTC_Z)
+            _REDIS.setex(_REDIS_KEY, CACHE_TTL, body)
+            return payload
+
+        # 取得役は別のワーカー。結果が置かれるのを最大 200ms ほど待つ
+        for _ in range(4):
+            time.sleep(0.05)
+            cached = _REDIS.get(_REDIS_KEY)
+            if cached is not None:
+                return orjson.loads(cached)
+
+        # 待ちきれなかったら自分で取得する（まれな重複は許容する）
+        return _fetch_payload()
+
+    except redis.RedisError:
+        # Redis が落ちていても機能は止めない（共有なしで続行）
+        return _fetch_payload()
+
+
+def _store_payload(payload):
+    """取得できた payload をキャッシュへ保存し、SSE の全接続を起こす。"""
+    _CACHE["payload"] = payload
+
+    # created 時刻から ETag（弱い検証子 W/"..."）を計算しておく。
+    # created が変わらない限り内容も変わらないので、指紋は created で十分。
+    # ※Redis 経由で受け取った payload では created が JSON 化済みの文字列
+    #   （orjson の 'Z' 表記）になっている。datetime のまま isoformat() すると
+    #   '+00:00' 表記になり、同じデータなのにワーカーごとに ETag がずれて
+    #   304 が効かなくなるので、必ず orjson と同じ表記に揃えてから計算する
+    created = payload.get("created")
+    if created is None:
+        token = "empty"
+    elif isinstance(created, str):
+        token = created
+    else:
+        # orjson.dumps(datetime) は '"...Z"' という JSON 文字列を返すので、
+        # 両端の引用符を外せば Redis 経由の文字列と同じ表記になる
+        token = orjson.dumps(created, option=orjson.OPT_UTC_Z).decode()[1:-1]
+    digest = hashlib.blake2s(token.encode(), digest_size=8).hexdigest()
+    _CACHE["etag"] = f'W/"{digest}"'
+    # 取得できたので「失敗し続けている」状態も解除する
+    _CACHE["stale_since"] = None
+
+    # SSE ジェネレータたち（_sse_stream）に「新しいデータが来た」と知らせる。
+    # 通し番号も一緒に進める：wait() の外にいた（yield で送信中だった）
+    # ジェネレータも、戻ってきたときに番号の差で更新に気づける
+    with _UPDATED:
+        _CACHE["seq"] += 1
+        _UPDATED.notify_all()
+
+
+def _sse_stream():
+    """SSE 1接続ぶんのジェネレータ。
+
+    接続直後にまず現在の状態を全量送り、以降はキャッシュが
+    更新されるたび（_store_payload の notify_all）に、
+    「この接続へ前回送った値から変わった項目だけ」（差分）を送る。
+    画面側の apply() は受け取った項目しか触らないので、差分で十分。
+    更新が無い間も HEARTBEAT_SEC ごとにコメント行を流して接続を保つ。
+    メッセージは _sse_frame で bytes として組み立てて、そのまま書き出す。
+    """
 
-        # d1〜d4 を float に変換（失敗したら None）
-        vals = {k: _to_num(row.get(k)) for k in ["d1", "d2", "d3", "d4"]}
+    # この接続へ最後に送った values（差分計算用。接続ごとに独立して持つ）
+    # ※None も正当な値なので、「まだ送っていない」は専用の目印で区別する
+    missing = object()
+    last_values = {}
+
+    # 接続した瞬間に手元のキャッシュがあれば、待たずにまず全量を表示させる。
+    # seq（更新の通し番号）も一緒に控えて、どこまで送ったかを覚えておく
+    with _UPDATED:
+        last_seq = _CACHE["seq"]
+        payload = _CACHE["payload"]
+    if payload is not None:
+        last_values = dict(payload["values"])
+        yield _sse_frame(payload)
+
+    while True:
+        # 次の更新が来るまで待つ（取得スレッドが notify_all してくれる）。
+        # notify_all は wait() 中の相手にしか届かないので、yield で送信中に
+        # 更新が走った場合に備えて、待つ前に通し番号を比べる。
+        # 番号が進んでいなければ HEARTBEAT_SEC だけ待つ（来なければ heartbeat）
+        with _UPDATED:
+            if _CACHE["seq"] == last_seq:
+                _UPDATED.wait(timeout=HEARTBEAT_SEC)
+            seq = _CACHE["seq"]
+            payload = _CACHE["payload"]
+
+        if seq == last_seq or payload is None:
+            # 更新なし：接続維持のコメント行だけ流す
+            yield _HEARTBEAT_FRAME
+            continue
+
+        last_seq = seq
+
+        # 前回送った値から変わった項目だけ抜き出して送る
+        changed = {
+            k: v for k, v in payload["values"].items()
+            if last_values.get(k, missing) != v
+        }
+        last_values = dict(payload["values"])
+
+        delta = {
+            "created": payload["created"],
+            "server_now": payload["server_now"],
+            "values": changed,
+        }
+        yield _sse_frame(delta)
+
+
+def _sse_frame(payload):
+    """SSE 1メッセージぶん（"data: <JSON>\\n\\n"）のバイト列を組み立てる。
+
+    固定の枠は bytes 定数の連結で済ませ、JSON 化は orjson に任せる。
+    文字列にしてから encode し直すより一段速く、余計なコピーも無い。
+    """
+    return _FRAME_PREFIX + orjson.dumps(payload, option=orjson.OPT_UTC_Z) + _FRAME_SUFFIX
 
-        # ブラウザへ返す JSON
-        return jsonify({
-            "created": created_dt.isoformat(),
-            "server_now": datetime.now(timezone.utc).isoformat(),
-            "values": vals,
-        })
 
-    except requests.RequestException as e:
-        # ネットワークエラー / タイムアウト / HTTP エラーなど
-        return jsonify({"error": str(e)}), 502
+def _poller():
+    """バックグラウンドで 30 秒ごとに Ambient から取得し続けるスレッド。
 
-    except ValueError as e:
-        # Ambient からのレスポンス形式がおかしい等
-        return jsonify({"error": f"Invalid response from Ambient: {e}"}), 502
+    取得に失敗しても止めず、次の周期でまた試す（画面側は
+    古いキャッシュ＝最後に取れた状態のまま表示が続く）。
+    """
+    while True:
+        with _CACHE["lock"]:
+            try:
+                _store_payload(_fetch_shared())
+            except (requests.RequestException, ValueError):
+                # 失敗し始めた時刻だけ記録して、次の周期に任せる
+                if _CACHE["stale_since"] is None:
+                    _CACHE["stale_since"] = time.monotonic()
 
+        time.sleep(POLL_INTERVAL)
+
+
+def _json(payload, status=200):
+    """payload を orjson で JSON レスポンスにして返す。
+
+    標準の jsonify（stdlib json）よりシリアライズが数倍速く、
+    datetime もそのまま扱える（OPT_UTC_Z で UTC を 'Z' 表記にする）。
+    """
+    return Response(
+        orjson.dumps(payload, option=orjson.OPT_UTC_Z),
+        status=status,
+        mimetype="application/json",
+    )
+
+
+def _cached_response():
+    """キャッシュ済みの payload を JSON レスポンスにして返す。
+
+    Cache-Control を付けて、ブラウザ（や手前のプロキシ）側でも
+    TTL の間はキャッシュを使ってよいと伝える。
+    さらに ETag を付け、ブラウザが同じ ETag を If-None-Match で
+    送ってきたら、本文なしの 304 Not Modified だけ返して転送量を節約する。
+    """
+    etag = _CACHE["etag"]
+
+    # ブラウザ側のキャッシュがまだ最新 → 本文を送り直す必要なし
+    if etag is not None and request.headers.get("If-None-Match") == etag:
+        return Response(
+            status=304,
+            headers={"ETag": etag, "Cache-Control": _CACHE_CONTROL},
+        )
+
+    resp = _json(_CACHE["payload"])
+    resp.headers["Cache-Control"] = _CACHE_CONTROL
+    # 圧縮の有無でキャッシュを取り違えないようにする
+    resp.headers["Vary"] = "Accept-Encoding"
+    if etag is not None:
+        resp.headers["ETag"] = etag
+    return resp
+
+
+def _stale_or_error(message):
+    """Ambient から取得できなかったときの応答を決める。
+
+    直近の取得結果（キャッシュ）が残っていて、失敗し始めてから
+    STALE_MAX 秒以内なら、502 を返す代わりに古いデータをそのまま返す。
+    これで一時的な障害のたびに画面が「取得エラー」に切り替わるのを防ぐ。
+    古いデータには X-Stale ヘッダを付けて区別できるようにする。
+    """
+    now = time.monotonic()
+
+    # 最初の失敗なら「いつから失敗しているか」を記録する
+    if _CACHE["stale_since"] is None:
+        _CACHE["stale_since"] = now
+
+    # キャッシュが残っていて、失敗期間がまだ許容範囲内 → 古いデータで代用
+    if _CACHE["payload"] is not None and now - _CACHE["stale_since"] < STALE_MAX:
+        resp = _json(_CACHE["payload"])
+        resp.headers["X-Stale"] = "true"
+        # 古いデータなので、ブラウザ側のキャッシュは短め（5秒）にする
+        resp.headers["Cache-Control"] = "max-age=5"
+        return resp
+
+    # キャッシュが無い／古すぎる → 従来どおり 502 エラー
+    return _json({"error": message}, status=502)
 
-# ===== ヘルパ関数 =====
 
 def _to_num(v):
     """Ambient の値（文字列 or 数値）を float に変換。
@@ -374,29 +902,47 @@ def _parse_iso8601(s: str):
         return None
 
     try:
-        # "2025-12-22T00:00:00Z" のような末尾 Z を +00:00 に置換
+        # "2025-12-22T00:00:00Z" のような末尾 Z は「UTC そのもの」なので、
+        # +00:00 への置換 → astimezone の変換を通さず、
+        # tzinfo を直接 UTC にして返す（Ambient はほぼ常にこの形式）
         if s.endswith("Z"):
-            return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
+            return datetime.fromisoformat(s[:-1]).replace(tzinfo=_UTC)
 
         # fromisoformat は "YYYY-MM-DDTHH:MM:SS+09:00" 等をパースできる
         dt = datetime.fromisoformat(s)
 
         # タイムゾーン情報が無い（naive datetime）場合は UTC とみなす
         if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
+            return dt.replace(tzinfo=_UTC)
 
-        # 最終的に UTC に揃えて返す
-        return dt.astimezone(timezone.utc)
+        # 既に UTC（オフセット 0）なら変換不要。それ以外だけ UTC に揃える
+        if dt.utcoffset().total_seconds() == 0:
+            return dt
+        return dt.astimezone(_UTC)
 
     except Exception:
         # どんな例外でも None を返す（壊れた created 等）
         return None
 
 
+# ===== バックグラウンドの定期取得スレッドを起動 =====
+
+# プロセスにつき1本だけ。daemon=True なのでサーバ終了時に一緒に終わる。
+# このスレッドが Ambient への唯一の定期アクセスになり、
+# SSE の全接続はキャッシュ経由で同じ結果を受け取る。
+_POLLER_THREAD = threading.Thread(target=_poller, daemon=True)
+_POLLER_THREAD.start()
+
+
 # このファイルが「直接 python で実行」された時だけ、開発用サーバを起動
-# （他のファイルから import された時は起動しない）
+# （gunicorn から import された時は起動しない）
+#
+# 本番ではファイル先頭の docstring にある gunicorn コマンドで起動すること。
+# Werkzeug の開発サーバはデフォルトで1スレッドなので、Ambient 待ちの
+# リクエスト1本が他の全閲覧者をブロックしてしまう。
 if __name__ == "__main__":
     # host=0.0.0.0: 外部（同一ネットワーク）からもアクセス可能
-    # port=5000: 5000 番ポートで待ち受け
-    # debug=True: 開発用（エラー詳細表示・自動リロード）
-    app.run(host="0.0.0.0", port=8080, debug=False)
+    # port=8080: 8080 番ポートで待ち受け
+    # threaded=True: 開発サーバでもリクエストごとにスレッドを立てて、
+    #                SSE の接続維持中に他のリクエストを処理できるようにする
+    app.run(host="0.0.0.0", port=8080, debug=False, threaded=True)